@@ -5,17 +5,90 @@ This script tracks your Apple devices using pyicloud
 """
 
 import os
+import re
 import sys
 import json
-import pickle
+import math
+import time
+import asyncio
+import argparse
 from datetime import datetime
-from pyicloud import PyiCloudService
+from functools import lru_cache
+from http.cookiejar import LWPCookieJar, LoadError
+
+try:
+    import orjson
+
+    def json_bytes(obj):
+        """Serialize obj as indented JSON"""
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+except ImportError:
+    def json_bytes(obj):
+        """Serialize obj as indented JSON"""
+        return json.dumps(obj, indent=2).encode()
+
+
+SEPARATOR = "=" * 80
+
+# Output templates for display_device_info
+DEVICE_TEMPLATE = (
+    "\nDevice #{0}\n"
+    + "-" * 80 + "\n"
+    "Name: {1}\n"
+    "Model: {2}\n"
+    "Device Class: {3}\n"
+    "Device Model: {4}"
+)
+
+LOCATION_TEMPLATE = (
+    "\nLocation:\n"
+    "  Latitude: {0}\n"
+    "  Longitude: {1}\n"
+    "  Accuracy: {2} meters"
+)
+
+EARTH_RADIUS_KM = 6371.0088
+
+# (distance from home in km, refresh interval in seconds), checked in order
+INTERVAL_TIERS = ((2.5, 15), (10, 60))
+FAR_INTERVAL = 300
+
+# Device fields kept as the status part of a snapshot
+STATUS_FIELDS = ('batteryLevel', 'batteryStatus', 'deviceDisplayName', 'deviceStatus', 'name')
+
+
+def has_valid_session(cookie_directory, email):
+    """Check pyicloud's saved session files without touching the network"""
+    # pyicloud names them after the word characters of the account name
+    name = re.sub(r"\W", "", email)
+    jar = LWPCookieJar(os.path.join(cookie_directory, name + ".cookiejar"))
+
+    try:
+        # Expired cookies are dropped while loading
+        jar.load(ignore_discard=True)
+        with open(os.path.join(cookie_directory, name + ".session")) as f:
+            session_token = json.load(f).get('session_token')
+    except (OSError, LoadError, ValueError):
+        return False
+
+    return len(jar) > 0 and bool(session_token)
+
+
+def get_password(email):
+    """Look up the saved password in the system keyring"""
+    import keyring
+    from keyring.errors import KeyringError
+
+    try:
+        return keyring.get_password("icloud", email)
+    except KeyringError:
+        return None
 
 
 def load_session():
     """Load saved iCloud session or create new one"""
 
-    session_file = "icloud_session.pkl"
+    session_file = "icloud_session.json"
 
     if not os.path.exists(session_file):
         print(f"Error: No saved session found at {session_file}")
@@ -25,13 +98,26 @@ def load_session():
     print("Loading saved session...")
 
     try:
-        with open(session_file, 'rb') as f:
-            session_data = pickle.load(f)
+        with open(session_file) as f:
+            session_data = json.load(f)
 
-        api = PyiCloudService(
-            session_data['email'],
-            session_data['password']
-        )
+        email = session_data['email']
+        cookie_directory = session_data['cookie_directory']
+        password = get_password(email)
+
+        # With unexpired cookies pyicloud reuses the trusted session; otherwise
+        # it can only log in again with the password saved in the keyring
+        if not has_valid_session(cookie_directory, email):
+            if not password:
+                print("\nSession expired. Please re-authenticate.")
+                print("Run: poetry run python setup/icloud_auth.py")
+                return None
+            print("Saved session expired, logging in again...")
+
+        # Only pay for importing pyicloud once there is a session to restore
+        from pyicloud import PyiCloudService
+
+        api = PyiCloudService(email, password, cookie_directory=cookie_directory)
 
         # Check if re-authentication is needed
         if api.requires_2fa or api.requires_2sa:
@@ -48,13 +134,19 @@ def load_session():
         return None
 
 
-def fetch_devices(api):
-    """Fetch all devices from Find My iPhone"""
+def fetch_devices(api, device_name=None):
+    """Fetch all devices from Find My iPhone, or only the one named device_name"""
 
     print("Fetching your devices...")
 
     try:
         devices = api.devices
+
+        if device_name:
+            devices = [d for d in devices if d.data.get('name') == device_name]
+            if not devices:
+                print(f"No device named '{device_name}' found.")
+
         return devices
     except Exception as e:
         print(f"Error fetching devices: {e}")
@@ -63,122 +155,323 @@ def fetch_devices(api):
         return []
 
 
-def display_device_info(devices):
+def load_refresh_cache(cache_file):
+    """Load the status/location last fetched for each device id"""
+    if not os.path.exists(cache_file):
+        return {}
+
+    try:
+        with open(cache_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_refresh_cache(cache_file, cache):
+    """Save the status/location last fetched for each device id"""
+    with open(cache_file, 'w') as f:
+        json.dump(cache, f)
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in km (haversine)"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def compute_intervals(locations, home_lat, home_lon):
+    """Pick a refresh interval in seconds for each location by its distance from home
+
+    Devices without a known location get 0 so they are refreshed on the
+    next poll.
+    """
+    intervals = []
+
+    for location in locations:
+        if not location or location.get('latitude') is None or location.get('longitude') is None:
+            intervals.append(0)
+            continue
+
+        distance = distance_km(location['latitude'], location['longitude'], home_lat, home_lon)
+        intervals.append(next(
+            (seconds for max_km, seconds in INTERVAL_TIERS if distance < max_km),
+            FAR_INTERVAL
+        ))
+
+    return intervals
+
+
+def load_hotspots(hotspots_file="hotspots.json"):
+    """Load known places as [{"lat": ..., "lon": ..., "radius_m": ...}, ...]"""
+    if not os.path.exists(hotspots_file):
+        return []
+
+    with open(hotspots_file) as f:
+        return json.load(f)
+
+
+def is_passive(entry, hotspots, passive_interval, now):
+    """Check whether a cached entry can be reused without waking the device
+
+    That is the case when its last fix is fresh (not isOld and younger than
+    passive_interval) and inside one of the hotspots.
+    """
+    location = entry.get('location')
+    if not location or location.get('isOld', True) or not location.get('timeStamp'):
+        return False
+
+    if now - location['timeStamp'] / 1000 >= passive_interval:
+        return False
+
+    return any(
+        distance_km(location['latitude'], location['longitude'],
+                    spot['lat'], spot['lon']) * 1000 <= spot['radius_m']
+        for spot in hotspots
+    )
+
+
+def positive_float(value):
+    """Parse a command line number of seconds that must be above zero"""
+    try:
+        seconds = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a number but got '{value}'")
+    if not 0 < seconds < math.inf:
+        raise argparse.ArgumentTypeError(f"must be a finite number above 0, got '{value}'")
+    return seconds
+
+
+def parse_coordinates(value):
+    """Parse a 'LAT,LON' command line value"""
+    try:
+        lat, lon = (float(part) for part in value.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected LAT,LON but got '{value}'")
+    return lat, lon
+
+
+def refresh_devices(api):
+    """Refresh every Find My device of the account with one request"""
+    manager = api.devices
+    # pyicloud 2.7+ names it refresh(); earlier 2.x releases refresh_client_with_reauth()
+    refresh = getattr(manager, 'refresh', None) or manager.refresh_client_with_reauth
+    refresh()
+
+
+async def fetch_snapshots(api, devices, min_interval=0, cache_file="last_refresh.json",
+                          intervals=None, hotspots=None, passive_interval=900, tolerance=0):
+    """Fetch a (device, data, status, location) snapshot of every device
+
+    One account refresh updates every device at once, so it is run a
+    single time (off the event loop) and status and location are read
+    from the refreshed device data; display and export share the
+    snapshots. With min_interval set, devices refreshed less than
+    min_interval seconds ago are served from cache_file and the refresh
+    is skipped when none are due. intervals maps device ids to their own
+    minimum interval, overriding min_interval. Devices last seen inside
+    one of hotspots are left alone while that fix is younger than
+    passive_interval. A device counts as due up to tolerance seconds
+    early, so ages measured on a fixed tick grid don't miss their turn
+    by a few milliseconds.
+    """
+    intervals = intervals or {}
+    hotspots = hotspots or []
+    use_cache = bool(min_interval or intervals or hotspots)
+    cache = load_refresh_cache(cache_file) if use_cache else {}
+    now = time.time()
+
+    stale = []
+    for device in devices:
+        device_id = device.data.get('id')
+        entry = cache.get(device_id, {})
+
+        if hotspots and is_passive(entry, hotspots, passive_interval, now):
+            continue
+
+        if now - entry.get('timestamp', 0) >= intervals.get(device_id, min_interval) - tolerance:
+            stale.append(device)
+
+    if stale:
+        await asyncio.to_thread(refresh_devices, api)
+
+        for device in stale:
+            data = device.data
+            cache[data.get('id')] = {
+                "timestamp": now,
+                "status": {field: data.get(field) for field in STATUS_FIELDS},
+                "location": data.get('location')
+            }
+
+        if use_cache:
+            save_refresh_cache(cache_file, cache)
+
+    snapshots = []
+    for device in devices:
+        data = device.data
+        entry = cache[data.get('id')]
+        snapshots.append((device, data, entry['status'], entry['location']))
+
+    return snapshots
+
+
+async def watch(api, devices, interval, min_interval=0, home=None, hotspots=None,
+                passive_interval=900):
+    """Keep displaying devices every interval seconds on one session
+
+    With home set to (lat, lon), each device's next refresh is spaced out
+    according to how far it is from home, rounded to the nearest tick; the
+    shorter tiers only take effect when interval is shorter than them.
+    """
+    intervals = None
+    start = time.monotonic()
+    ticks = 0
+
+    try:
+        while True:
+            # A failed refresh shouldn't end an unattended watch; try again next tick
+            try:
+                snapshots = await fetch_snapshots(api, devices, min_interval,
+                                                  intervals=intervals, hotspots=hotspots,
+                                                  passive_interval=passive_interval,
+                                                  tolerance=interval / 2)
+                display_device_info(snapshots)
+
+                if home:
+                    ids = [data.get('id') for _, data, _, _ in snapshots]
+                    locations = [location for _, _, _, location in snapshots]
+                    intervals = dict(zip(ids, compute_intervals(locations, *home)))
+            except Exception as e:
+                print(f"\nError refreshing devices: {e}")
+
+            # Refresh on a fixed grid so slow fetches don't delay every later refresh
+            ticks = max(ticks + 1, math.ceil((time.monotonic() - start) / interval))
+            delay = max(0, start + ticks * interval - time.monotonic())
+            print(f"\nNext refresh in {delay:.0f} seconds (Ctrl+C to stop)...")
+            await asyncio.sleep(delay)
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        print("\nStopped watching.")
+
+
+@lru_cache(maxsize=64)
+def format_timestamp(seconds):
+    """Format a Unix timestamp in seconds as local 'YYYY-MM-DD HH:MM:SS'"""
+    return datetime.fromtimestamp(seconds).isoformat(sep=' ', timespec='seconds')
+
+
+def display_device_info(snapshots):
     """Display information about each device"""
 
-    if not devices:
+    if not snapshots:
         print("No devices found.")
         return
 
-    print(f"Found {len(devices)} device(s):\n")
-    print("=" * 80)
-
-    for i, device in enumerate(devices, 1):
-        print(f"\nDevice #{i}")
-        print("-" * 80)
+    sys.stdout.write(f"Found {len(snapshots)} device(s):\n\n{SEPARATOR}\n")
 
-        # Basic info
-        data = device.data
-        status = device.status()
+    for i, (device, data, status, location) in enumerate(snapshots, 1):
+        # Bind the lookups once per device instead of once per field
+        d_get = data.get
+        s_get = status.get
 
-        print(f"Name: {data.get('name', 'Unknown')}")
-        print(f"Model: {data.get('deviceDisplayName', 'Unknown')}")
-        print(f"Device Class: {data.get('deviceClass', 'Unknown')}")
-        print(f"Device Model: {data.get('rawDeviceModel', 'Unknown')}")
+        # Collect every line for the device and write them out at once
+        name, model, device_class, raw_model = (
+            d_get(k, 'Unknown')
+            for k in ('name', 'deviceDisplayName', 'deviceClass', 'rawDeviceModel')
+        )
+        lines = [DEVICE_TEMPLATE.format(i, name, model, device_class, raw_model)]
 
         # Location info
-        try:
-            location = device.location()
-        except:
-            location = None
-
         if location:
-            print(f"\nLocation:")
-            print(f"  Latitude: {location.get('latitude', 'N/A')}")
-            print(f"  Longitude: {location.get('longitude', 'N/A')}")
-            print(f"  Accuracy: {location.get('horizontalAccuracy', 'N/A')} meters")
+            l_get = location.get
+            lines.append(LOCATION_TEMPLATE.format(
+                l_get('latitude', 'N/A'),
+                l_get('longitude', 'N/A'),
+                l_get('horizontalAccuracy', 'N/A')
+            ))
 
             # Timestamp
-            timestamp = location.get('timeStamp')
+            timestamp = l_get('timeStamp')
             if timestamp:
-                dt = datetime.fromtimestamp(timestamp / 1000)
-                print(f"  Last Updated: {dt.strftime('%Y-%m-%d %H:%M:%S')}")
-
-            # Position type
-            position_type = location.get('positionType', 'Unknown')
-            print(f"  Position Type: {position_type}")
+                lines.append(f"  Last Updated: {format_timestamp(timestamp // 1000)}")
 
-            # Is old location
-            is_old = location.get('isOld', False)
-            print(f"  Is Old Location: {is_old}")
+            lines.append(f"  Position Type: {l_get('positionType', 'Unknown')}")
+            lines.append(f"  Is Old Location: {l_get('isOld', False)}")
         else:
-            print("\nLocation: Not available")
+            lines.append("\nLocation: Not available")
 
         # Battery info
-        battery_level = status.get('batteryLevel')
+        battery_level = s_get('batteryLevel')
         if battery_level is not None:
-            print(f"\nBattery: {battery_level * 100:.0f}%")
+            lines.append(f"\nBattery: {battery_level * 100:.0f}%")
 
-        battery_status = status.get('batteryStatus')
+        battery_status = s_get('batteryStatus')
         if battery_status:
-            print(f"Battery Status: {battery_status}")
+            lines.append(f"Battery Status: {battery_status}")
 
         # Device status
-        device_status = data.get('deviceStatus')
+        device_status = d_get('deviceStatus')
         if device_status:
-            print(f"Device Status: {device_status}")
+            lines.append(f"Device Status: {device_status}")
 
-        # Lost mode
-        lost_mode_capable = data.get('lostModeCapable', False)
-        print(f"Lost Mode Capable: {lost_mode_capable}")
+        lines.append(f"Lost Mode Capable: {d_get('lostModeCapable', False)}")
+        lines.append(f"Location Enabled: {d_get('locationEnabled', False)}")
+        lines.append(SEPARATOR)
 
-        # Location enabled
-        location_enabled = data.get('locationEnabled', False)
-        print(f"Location Enabled: {location_enabled}")
+        sys.stdout.write("\n".join(lines) + "\n")
 
-        print("=" * 80)
 
+def iter_device_info(snapshots):
+    """Yield the exportable data for each device"""
 
-def export_to_json(devices, filename="icloud_devices.json"):
-    """Export device data to JSON file"""
-
-    device_data = []
-
-    for device in devices:
-        data = device.data
-        status = device.status()
-
-        try:
-            location = device.location()
-        except:
-            location = None
+    for device, data, status, location in snapshots:
+        d_get = data.get
+        s_get = status.get
 
         device_info = {
-            "name": data.get('name', 'Unknown'),
-            "model": data.get('deviceDisplayName', 'Unknown'),
-            "device_class": data.get('deviceClass', 'Unknown'),
-            "raw_model": data.get('rawDeviceModel', 'Unknown'),
-            "device_status": data.get('deviceStatus', 'Unknown'),
-            "battery_level": status.get('batteryLevel'),
-            "battery_status": status.get('batteryStatus'),
-            "location_enabled": data.get('locationEnabled', False),
-            "lost_mode_capable": data.get('lostModeCapable', False)
+            "name": d_get('name', 'Unknown'),
+            "model": d_get('deviceDisplayName', 'Unknown'),
+            "device_class": d_get('deviceClass', 'Unknown'),
+            "raw_model": d_get('rawDeviceModel', 'Unknown'),
+            "device_status": d_get('deviceStatus', 'Unknown'),
+            "battery_level": s_get('batteryLevel'),
+            "battery_status": s_get('batteryStatus'),
+            "location_enabled": d_get('locationEnabled', False),
+            "lost_mode_capable": d_get('lostModeCapable', False)
         }
 
         if location:
+            l_get = location.get
             device_info["location"] = {
-                "latitude": location.get('latitude'),
-                "longitude": location.get('longitude'),
-                "accuracy": location.get('horizontalAccuracy'),
-                "timestamp": location.get('timeStamp'),
-                "position_type": location.get('positionType'),
-                "is_old": location.get('isOld', False)
+                "latitude": l_get('latitude'),
+                "longitude": l_get('longitude'),
+                "accuracy": l_get('horizontalAccuracy'),
+                "timestamp": l_get('timeStamp'),
+                "position_type": l_get('positionType'),
+                "is_old": l_get('isOld', False)
             }
 
-        device_data.append(device_info)
+        yield device_info
+
+
+def write_json_array(records, filename):
+    """Stream records to filename as a JSON array, one record at a time"""
+    with open(filename, 'wb') as f:
+        f.write(b"[")
+        first = True
+
+        for record in records:
+            f.write(b"\n  " if first else b",\n  ")
+            first = False
+            f.write(json_bytes(record).replace(b"\n", b"\n  "))
+
+        f.write(b"]\n" if first else b"\n]\n")
+
+
+def export_to_json(snapshots, filename="icloud_devices.json"):
+    """Export device data to JSON file"""
 
-    with open(filename, 'w') as f:
-        json.dump(device_data, f, indent=2)
+    write_json_array(iter_device_info(snapshots), filename)
 
     print(f"\nDevice data exported to {filename}")
 
@@ -190,9 +483,87 @@ def play_sound(device):
     print("Sound request sent!")
 
 
-def main():
+def interactive_menu(devices, snapshots):
+    """Ask what to do next with the fetched devices"""
+    print("\nOptions:")
+    print("1. Export device data to JSON")
+    print("2. Play sound on a device")
+    print("3. Exit")
+
+    choice = input("\nEnter your choice [1-3]: ").strip()
+
+    if choice == '1':
+        export_to_json(snapshots)
+    elif choice == '2':
+        for i, device in enumerate(devices):
+            print(f"{i}: {device.data.get('name')}")
+        device_index = int(input("\nSelect device (enter number): ").strip())
+        if 0 <= device_index < len(devices):
+            play_sound(devices[device_index])
+        else:
+            print("Invalid device number")
+
+
+def parse_args(argv=None):
+    """Parse command line arguments
+
+    Running without a command is the same as 'list --interactive'.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv:
+        argv = ["list", "--interactive"]
+
+    # Options shared by every command
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--device", metavar="NAME",
+                        help="only use the device with this name")
+    common.add_argument("--min-interval", type=float, default=0, metavar="SEC",
+                        help="reuse data cached in last_refresh.json if it is newer than SEC seconds")
+    common.add_argument("--hotspots", default="hotspots.json", metavar="FILE",
+                        help="known places to track passively (default: hotspots.json, if it exists)")
+    common.add_argument("--passive-interval", type=float, default=900, metavar="SEC",
+                        help="how long a fix inside a hotspot is reused before waking the device")
+
+    parser = argparse.ArgumentParser(
+        description="Track your Apple devices using pyicloud",
+        epilog="Without a command, runs 'list --interactive'."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = commands.add_parser("list", parents=[common], help="show every device")
+    list_parser.add_argument("--interactive", action="store_true",
+                             help="offer to export or play a sound afterwards")
+
+    export_parser = commands.add_parser("export", parents=[common],
+                                        help="export device data to JSON")
+    export_parser.add_argument("--file", default="icloud_devices.json",
+                               help="output file (default: icloud_devices.json)")
+
+    sound_parser = commands.add_parser("play-sound", parents=[common],
+                                       help="play a sound on the device given with --device")
+
+    watch_parser = commands.add_parser("watch", parents=[common],
+                                       help="keep refreshing on one session")
+    watch_parser.add_argument("--interval", type=positive_float, default=300, metavar="SEC",
+                              help="seconds between refreshes (default: 300)")
+    watch_parser.add_argument("--home", type=parse_coordinates, metavar="LAT,LON",
+                              help="refresh devices less often the further they are from home "
+                                   "(15 s within 2.5 km, 60 s within 10 km, else 300 s; "
+                                   "needs a shorter --interval to take effect)")
+
+    args = parser.parse_args(argv)
+    if args.command == "play-sound" and not args.device:
+        sound_parser.error("--device is required")
+
+    return args
+
+
+async def main(argv=None):
     """Main entry point"""
 
+    args = parse_args(argv)
+
     print("=" * 80)
     print("iCloud Device Tracker")
     print("=" * 80)
@@ -205,30 +576,35 @@ def main():
 
     try:
         # Fetch devices
-        devices = fetch_devices(api)
-
-        # Display device info
-        display_device_info(devices)
-
-        # Interactive menu
-        if devices:
-            print("\nOptions:")
-            print("1. Export device data to JSON")
-            print("2. Play sound on a device")
-            print("3. Exit")
-
-            choice = input("\nEnter your choice [1-3]: ").strip()
-
-            if choice == '1':
-                export_to_json(devices)
-            elif choice == '2':
-                for i, device in enumerate(devices):
-                    print(f"{i}: {device.data.get('name')}")
-                device_index = int(input("\nSelect device (enter number): ").strip())
-                if 0 <= device_index < len(devices):
-                    play_sound(devices[device_index])
-                else:
-                    print("Invalid device number")
+        devices = fetch_devices(api, args.device)
+
+        if args.command == "play-sound":
+            if not devices:
+                return 1
+            play_sound(devices[0])
+            print("\nDone!")
+            return 0
+
+        hotspots = load_hotspots(args.hotspots)
+
+        if args.command == "watch":
+            await watch(api, devices, args.interval, args.min_interval, args.home,
+                        hotspots, args.passive_interval)
+            print("\nDone!")
+            return 0
+
+        snapshots = await fetch_snapshots(api, devices, args.min_interval,
+                                          hotspots=hotspots,
+                                          passive_interval=args.passive_interval)
+
+        if args.command == "export":
+            export_to_json(snapshots, args.file)
+        else:
+            # Display device info
+            display_device_info(snapshots)
+
+            if args.interactive and devices:
+                interactive_menu(devices, snapshots)
 
     except Exception as e:
         print(f"\nError: {e}")
@@ -241,4 +617,4 @@ def main():
 
 
 if __name__ == "__main__":
-    sys.exit(main())
+    sys.exit(asyncio.run(main()))
@@ -6,11 +6,93 @@ This script tracks your Apple devices using a saved FindMy.py session
 
 import os
 import sys
+import math
+import time
 import asyncio
+import argparse
 import json
 from datetime import datetime
+from functools import lru_cache
+from operator import attrgetter
 from findmy import AppleAccount
 
+try:
+    import orjson
+
+    def json_bytes(obj):
+        """Serialize obj as indented JSON"""
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+except ImportError:
+    def json_bytes(obj):
+        """Serialize obj as indented JSON"""
+        return json.dumps(obj, indent=2).encode()
+
+
+# Attribute names each field may be exposed under, in order of preference
+_DEVICE_ALIASES = {
+    "name": ('name', 'deviceName'),
+    "model": ('model_display_name', 'deviceDisplayName', 'deviceModel'),
+    "device_class": ('device_class', 'deviceClass'),
+    "battery_level": ('battery_level', 'batteryLevel'),
+    "battery_status": ('battery_status', 'batteryStatus'),
+    "is_online": ('is_online', 'isOnline'),
+}
+
+_LOCATION_ALIASES = {
+    "latitude": ('latitude', 'lat'),
+    "longitude": ('longitude', 'lon'),
+    "accuracy": ('horizontal_accuracy', 'horizontalAccuracy'),
+    "timestamp": ('timestamp', 'timeStamp'),
+    "address": ('address',),
+}
+
+# One C-level getter per alias, built once at import
+_GETTERS = {
+    name: attrgetter(name)
+    for aliases in (_DEVICE_ALIASES, _LOCATION_ALIASES)
+    for names in aliases.values()
+    for name in names
+}
+
+_LOCATION_DEFAULTS = dict.fromkeys(_LOCATION_ALIASES)
+
+# Values used for fields a device does not expose at all
+_DEVICE_DEFAULTS = {
+    "name": 'Unknown',
+    "model": 'Unknown',
+    "device_class": 'Unknown',
+    "battery_level": None,
+    "battery_status": None,
+    "is_online": None,
+}
+
+
+def _probe_aliases(sample, aliases):
+    """Map each field to the getter of the first alias that sample exposes"""
+    schema = {}
+    for key, names in aliases.items():
+        for name in names:
+            if hasattr(sample, name):
+                schema[key] = _GETTERS[name]
+                break
+    return schema
+
+
+def _probe_schema(devices):
+    """Work out the attribute names once, from the first device and location"""
+    schema = {"device": {}, "location": {}}
+
+    if devices:
+        schema["device"] = _probe_aliases(devices[0], _DEVICE_ALIASES)
+
+    for device in devices:
+        location = getattr(device, 'location', None)
+        if location:
+            schema["location"] = _probe_aliases(location, _LOCATION_ALIASES)
+            break
+
+    return schema
+
 
 async def load_account():
     """Load saved Apple Account session"""
@@ -35,6 +117,13 @@ async def fetch_devices(account):
     try:
         # Fetch current locations from FindMy
         locations = await account.fetch_location()
+
+        # Every device shares the same attribute names, so probe them once;
+        # keep probing until a device with a location has been seen
+        schema = getattr(account, '_schema', None)
+        if locations and not (schema and schema["location"]):
+            account._schema = _probe_schema(locations)
+
         return locations
     except Exception as e:
         print(f"Error fetching devices: {e}")
@@ -43,8 +132,38 @@ async def fetch_devices(account):
         return []
 
 
+def resolve_device(device, schema):
+    """Resolve the attributes of a device into a plain dict"""
+
+    info = dict(_DEVICE_DEFAULTS)
+    for key, getter in schema["device"].items():
+        try:
+            info[key] = getter(device)
+        except AttributeError:
+            pass
+
+    info["location"] = None
+
+    location = getattr(device, 'location', None)
+    if location:
+        info["location"] = dict(_LOCATION_DEFAULTS)
+        for key, getter in schema["location"].items():
+            try:
+                info["location"][key] = getter(location)
+            except AttributeError:
+                pass
+
+    return info
+
+
+@lru_cache(maxsize=64)
+def format_timestamp(seconds):
+    """Format a Unix timestamp in seconds as local 'YYYY-MM-DD HH:MM:SS'"""
+    return datetime.fromtimestamp(seconds).isoformat(sep=' ', timespec='seconds')
+
+
 def display_device_info(devices):
-    """Display information about each device"""
+    """Display information about each resolved device"""
 
     if not devices:
         print("No devices found.")
@@ -57,67 +176,53 @@ def display_device_info(devices):
         print(f"\nDevice #{i}")
         print("-" * 80)
 
-        # Basic info - try different attribute names
-        name = getattr(device, 'name', getattr(device, 'deviceName', 'Unknown'))
-        print(f"Name: {name}")
-
-        model = getattr(device, 'model_display_name',
-                       getattr(device, 'deviceDisplayName',
-                              getattr(device, 'deviceModel', 'Unknown')))
-        print(f"Model: {model}")
-
-        device_class = getattr(device, 'device_class',
-                              getattr(device, 'deviceClass', 'Unknown'))
-        print(f"Device Class: {device_class}")
+        print(f"Name: {device['name']}")
+        print(f"Model: {device['model']}")
+        print(f"Device Class: {device['device_class']}")
 
         # Location info
-        location = getattr(device, 'location', None)
+        location = device['location']
         if location:
             print(f"\nLocation:")
 
-            lat = getattr(location, 'latitude', getattr(location, 'lat', None))
-            lon = getattr(location, 'longitude', getattr(location, 'lon', None))
+            lat = location['latitude']
+            lon = location['longitude']
 
             if lat and lon:
                 print(f"  Latitude: {lat}")
                 print(f"  Longitude: {lon}")
 
-            accuracy = getattr(location, 'horizontal_accuracy',
-                             getattr(location, 'horizontalAccuracy', 'N/A'))
-            print(f"  Accuracy: {accuracy} meters" if accuracy != 'N/A' else f"  Accuracy: {accuracy}")
+            accuracy = location['accuracy']
+            print(f"  Accuracy: {accuracy} meters" if accuracy is not None else "  Accuracy: N/A")
 
             # Timestamp
-            timestamp = getattr(location, 'timestamp',
-                              getattr(location, 'timeStamp', None))
+            timestamp = location['timestamp']
             if timestamp:
                 try:
-                    dt = datetime.fromtimestamp(timestamp / 1000)  # Convert from milliseconds
-                    print(f"  Last Updated: {dt.strftime('%Y-%m-%d %H:%M:%S')}")
+                    # Convert from milliseconds
+                    print(f"  Last Updated: {format_timestamp(timestamp // 1000)}")
                 except:
                     print(f"  Last Updated: {timestamp}")
 
             # Address if available
-            address = getattr(location, 'address', None)
+            address = location['address']
             if address:
                 print(f"  Address: {address}")
         else:
             print("\nLocation: Not available")
 
         # Battery info
-        battery = getattr(device, 'battery_level',
-                         getattr(device, 'batteryLevel', None))
+        battery = device['battery_level']
         if battery is not None:
             print(f"\nBattery: {battery * 100:.0f}%")
 
         # Battery status
-        battery_status = getattr(device, 'battery_status',
-                                getattr(device, 'batteryStatus', None))
+        battery_status = device['battery_status']
         if battery_status:
             print(f"Battery Status: {battery_status}")
 
         # Online status
-        is_online = getattr(device, 'is_online',
-                           getattr(device, 'isOnline', None))
+        is_online = device['is_online']
         if is_online is not None:
             status = "Online" if is_online else "Offline"
             print(f"Status: {status}")
@@ -125,58 +230,98 @@ def display_device_info(devices):
         print("=" * 80)
 
 
-def export_to_json(devices, filename="devices.json"):
-    """Export device data to JSON file"""
+def iter_device_info(devices):
+    """Yield the exportable data for each resolved device"""
 
-    device_data = []
     for device in devices:
         data = {
-            "name": getattr(device, 'name', getattr(device, 'deviceName', 'Unknown')),
-            "model": getattr(device, 'model_display_name',
-                           getattr(device, 'deviceDisplayName',
-                                  getattr(device, 'deviceModel', 'Unknown'))),
-            "device_class": getattr(device, 'device_class',
-                                   getattr(device, 'deviceClass', 'Unknown')),
+            "name": device['name'],
+            "model": device['model'],
+            "device_class": device['device_class'],
         }
 
-        location = getattr(device, 'location', None)
-        if location:
-            lat = getattr(location, 'latitude', getattr(location, 'lat', None))
-            lon = getattr(location, 'longitude', getattr(location, 'lon', None))
-            accuracy = getattr(location, 'horizontal_accuracy',
-                             getattr(location, 'horizontalAccuracy', None))
-            timestamp = getattr(location, 'timestamp',
-                              getattr(location, 'timeStamp', None))
-            address = getattr(location, 'address', None)
-
-            data["location"] = {
-                "latitude": lat,
-                "longitude": lon,
-                "accuracy": accuracy,
-                "timestamp": timestamp,
-                "address": address
-            }
-
-        battery = getattr(device, 'battery_level',
-                         getattr(device, 'batteryLevel', None))
-        if battery is not None:
-            data["battery_level"] = battery
+        if device['location']:
+            data["location"] = device['location']
 
-        is_online = getattr(device, 'is_online',
-                           getattr(device, 'isOnline', None))
-        if is_online is not None:
-            data["is_online"] = is_online
+        if device['battery_level'] is not None:
+            data["battery_level"] = device['battery_level']
+
+        if device['is_online'] is not None:
+            data["is_online"] = device['is_online']
+
+        yield data
+
+
+def write_json_array(records, filename):
+    """Stream records to filename as a JSON array, one record at a time"""
+    with open(filename, 'wb') as f:
+        f.write(b"[")
+        first = True
+
+        for record in records:
+            f.write(b"\n  " if first else b",\n  ")
+            first = False
+            f.write(json_bytes(record).replace(b"\n", b"\n  "))
 
-        device_data.append(data)
+        f.write(b"]\n" if first else b"\n]\n")
 
-    with open(filename, 'w') as f:
-        json.dump(device_data, f, indent=2)
+
+def export_to_json(devices, filename="devices.json"):
+    """Export resolved device data to JSON file"""
+
+    write_json_array(iter_device_info(devices), filename)
 
     print(f"\nDevice data exported to {filename}")
 
 
-async def main():
+async def fetch_and_resolve(account):
+    """Fetch the latest locations and resolve them into dicts"""
+    devices = await fetch_devices(account)
+    schema = getattr(account, '_schema', None) or _probe_schema(devices)
+    return [resolve_device(d, schema) for d in devices]
+
+
+async def watch(account, interval):
+    """Keep displaying devices every interval seconds on one account session"""
+    start = time.monotonic()
+    ticks = 0
+
+    try:
+        while True:
+            display_device_info(await fetch_and_resolve(account))
+
+            # Refresh on a fixed grid so slow fetches don't delay every later refresh
+            ticks = max(ticks + 1, math.ceil((time.monotonic() - start) / interval))
+            delay = max(0, start + ticks * interval - time.monotonic())
+            print(f"\nNext refresh in {delay:.0f} seconds (Ctrl+C to stop)...")
+            await asyncio.sleep(delay)
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        print("\nStopped watching.")
+
+
+def positive_float(value):
+    """Parse a command line number of seconds that must be above zero"""
+    try:
+        seconds = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a number but got '{value}'")
+    if not 0 < seconds < math.inf:
+        raise argparse.ArgumentTypeError(f"must be a finite number above 0, got '{value}'")
+    return seconds
+
+
+def parse_args(argv=None):
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Track your Apple devices using FindMy.py")
+    parser.add_argument("--watch", type=positive_float, metavar="SEC",
+                        help="keep refreshing every SEC seconds instead of asking to export")
+    return parser.parse_args(argv)
+
+
+async def main(argv=None):
     """Main entry point"""
+    args = parse_args(argv)
+
     print("=" * 80)
     print("FindMy Device Tracker")
     print("=" * 80)
@@ -188,8 +333,13 @@ async def main():
         return 1
 
     try:
+        # The account and its Anisette/HTTP state are reused for every poll
+        if args.watch:
+            await watch(account, args.watch)
+            return 0
+
         # Fetch devices
-        devices = await fetch_devices(account)
+        devices = await fetch_and_resolve(account)
 
         # Display device info
         display_device_info(devices)
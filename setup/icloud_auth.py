@@ -4,8 +4,9 @@ iCloud Authentication Script
 This script handles Apple Account authentication using pyicloud
 """
 
-import os
-import pickle
+import json
+import keyring
+from keyring.errors import KeyringError
 from pyicloud import PyiCloudService
 
 
@@ -23,9 +24,11 @@ def authenticate():
 
     print("\nAuthenticating...")
 
+    cookie_directory = "icloud_cookies"
+
     try:
         # Create PyiCloudService instance
-        api = PyiCloudService(email, password)
+        api = PyiCloudService(email, password, cookie_directory=cookie_directory)
 
         # Check if 2FA is required
         if api.requires_2fa:
@@ -81,14 +84,22 @@ def authenticate():
         print("Authentication successful!")
         print("=" * 80)
 
-        # Save session to root directory
-        session_file = "icloud_session.pkl"
-        with open(session_file, 'wb') as f:
-            pickle.dump({
+        # pyicloud keeps its own cookies and session token in cookie_directory
+
+        # Keep the password in the system keyring rather than on disk
+        try:
+            keyring.set_password("icloud", email, password)
+        except KeyringError as e:
+            print(f"\nWarning: Could not store password in keyring: {e}")
+            print("You will need to re-authenticate once the saved cookies expire.")
+
+        # Save session manifest to root directory
+        session_file = "icloud_session.json"
+        with open(session_file, 'w') as f:
+            json.dump({
                 'email': email,
-                'password': password,
-                'cookies': api.session.cookies
-            }, f)
+                'cookie_directory': cookie_directory
+            }, f, indent=2)
 
         print(f"\nSession saved to: {session_file}")
         print("You can now use icloud_track.py to track your devices.")
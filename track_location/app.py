@@ -6,27 +6,117 @@ and provides an API endpoint to trigger the phone alarm.
 """
 
 import os
-import pickle
+import sys
+import math
+import logging
+import atexit
+import signal
 import threading
 import time
 import secrets
-from datetime import datetime
-from functools import wraps
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache, wraps
+import orjson
+from bson import ObjectId
 from dotenv import load_dotenv
 from flask import Flask, jsonify, request
-from pymongo import MongoClient
+from flask.json.provider import DefaultJSONProvider
+from pymongo import ASCENDING, DESCENDING, MongoClient, WriteConcern
 from pyicloud import PyiCloudService
+import keyring
+from keyring.errors import KeyringError
+from device_info import build_device_info
 
 # Load environment variables
 load_dotenv()
 
+
+class LevelPrefixFormatter(logging.Formatter):
+    """Log formatter that marks warnings and errors with an emoji"""
+
+    PREFIXES = {logging.WARNING: "⚠️  ", logging.ERROR: "❌ ", logging.CRITICAL: "❌ "}
+
+    def format(self, record):
+        return self.PREFIXES.get(record.levelno, "") + super().format(record)
+
+
+log_handler = logging.StreamHandler(sys.stdout)
+log_handler.setFormatter(LevelPrefixFormatter('%(message)s'))
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(), handlers=[log_handler])
+logger = logging.getLogger(__name__)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson
+
+    orjson encodes datetimes natively (naive ones as UTC, with a "Z"
+    suffix); ObjectIds are written as strings.
+    """
+
+    @staticmethod
+    def _default(obj):
+        """Encode types orjson does not know about"""
+        if isinstance(obj, ObjectId):
+            return str(obj)
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self._default, option=orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 # Global variables
 icloud_api = None
+mongo_client = None
+mongo_client_lock = threading.Lock()
 mongo_collection = None
+tracker_collection = None
 target_device = None
 tracking_active = False
+initialized_pid = None
+
+# Identity of the target device, fixed once it has been found
+DEVICE_ID = None
+DEVICE_NAME = None
+DEVICE_MODEL = None
+
+# Seconds between tracked samples
+TRACKING_INTERVAL = int(os.getenv('TRACKING_INTERVAL', 300))  # Default 5 minutes
+if TRACKING_INTERVAL <= 0:
+    raise ValueError("TRACKING_INTERVAL in .env file must be a positive number of seconds")
+
+# Fields of a sample returned by /location
+LOCATION_FIELDS = ("device_id", "name", "model", "battery_level", "battery_status",
+                   "timestamp", "location_data")
+LOCATION_PROJECTION = {"_id": 0, **dict.fromkeys(LOCATION_FIELDS, 1)}
+
+# When the newest sample was recorded; used as the /location ETag
+LAST_WRITE_TS = None
+
+# Seconds a fetched device status is reused for other /status requests
+STATUS_CACHE_TTL = int(os.getenv('STATUS_CACHE_TTL', 10))
+
+# Tracked samples waiting to be written to MongoDB in one batch
+BATCH_SIZE = int(os.getenv('BATCH_SIZE', 12))
+BATCH_MAX_AGE = int(os.getenv('BATCH_MAX_AGE', 3600))  # Seconds
+# Samples kept while MongoDB is unreachable; the oldest are dropped beyond this
+MAX_PENDING_SAMPLES = int(os.getenv('MAX_PENDING_SAMPLES', BATCH_SIZE * 24))
+pending_samples = deque()
+pending_lock = threading.Lock()
+pending_since = None
+
+# Seconds a sample is kept before MongoDB deletes it (default 30 days)
+RETENTION_SECONDS = int(os.getenv('RETENTION_SECONDS', 30 * 24 * 3600))
+
+# Batches are written on their own thread so the tracker never waits on MongoDB
+mongo_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mongo-writer")
 
 # API Key from environment
 API_KEY = os.getenv('API_KEY')
@@ -67,45 +157,147 @@ def require_api_key(f):
     return decorated_function
 
 
-def connect_to_mongodb():
-    """Connect to MongoDB and return the collection"""
-    mongodb_uri = os.getenv('MONGODB_URI')
+RATE_PERIODS = {"second": 1, "minute": 60, "hour": 3600}
+
+
+def rate_limit(limit):
+    """Decorator to limit an endpoint with a token bucket, e.g. rate_limit("5/minute")"""
+    count, period = limit.split('/')
+    capacity = int(count)
+    refill_rate = capacity / RATE_PERIODS[period]  # Tokens per second
+
+    bucket = {"tokens": float(capacity), "updated": time.monotonic()}
+    lock = threading.Lock()
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            with lock:
+                now = time.monotonic()
+                bucket["tokens"] = min(capacity, bucket["tokens"] + (now - bucket["updated"]) * refill_rate)
+                bucket["updated"] = now
 
-    if not mongodb_uri:
-        raise ValueError("MONGODB_URI not found in .env file")
+                if bucket["tokens"] < 1:
+                    retry_after = math.ceil((1 - bucket["tokens"]) / refill_rate)
+                    return jsonify({
+                        "error": "Too many requests",
+                        "message": f"Limited to {limit}, retry in {retry_after} seconds"
+                    }), 429, {"Retry-After": str(retry_after)}
 
-    client = MongoClient(mongodb_uri)
+                bucket["tokens"] -= 1
+
+            return f(*args, **kwargs)
+
+        return decorated_function
+
+    return decorator
+
+
+def get_mongo_client():
+    """Return the MongoClient shared by every thread in this process"""
+    global mongo_client
+
+    with mongo_client_lock:
+        if mongo_client is None:
+            mongodb_uri = os.getenv('MONGODB_URI')
+
+            if not mongodb_uri:
+                raise ValueError("MONGODB_URI not found in .env file")
+
+            # zstd (from the pymongo[zstd] extra) is preferred; servers
+            # without it fall back to zlib, which is always available
+            mongo_client = MongoClient(
+                mongodb_uri,
+                maxPoolSize=50,
+                maxIdleTimeMS=60000,
+                compressors='zstd,zlib',
+                zlibCompressionLevel=6,
+                serverSelectionTimeoutMS=5000,
+                socketTimeoutMS=10000
+            )
+
+        return mongo_client
+
+
+def connect_to_mongodb():
+    """Connect to MongoDB and return the collection"""
+    client = get_mongo_client()
     client.admin.command('ping')
-    print("✓ Connected to MongoDB")
+    logger.info("✓ Connected to MongoDB")
 
     db = client['findmy']
-    return db['device_locations']
+    collection = db['device_locations']
+
+    # Lets /location find the newest sample per device without a scan and sort
+    collection.create_index([("device_id", ASCENDING), ("timestamp", DESCENDING)])
+
+    # Let MongoDB expire old samples so the collection and its indexes stay small.
+    # Recreating the index with another TTL fails, so a changed RETENTION_SECONDS
+    # updates the existing one in place.
+    ttl_index = collection.index_information().get("timestamp_1")
+    if ttl_index is None:
+        collection.create_index("timestamp", expireAfterSeconds=RETENTION_SECONDS)
+    elif ttl_index.get("expireAfterSeconds") != RETENTION_SECONDS:
+        db.command("collMod", collection.name, index={
+            "keyPattern": {"timestamp": 1},
+            "expireAfterSeconds": RETENTION_SECONDS
+        })
+
+    return collection
+
+
+@lru_cache(maxsize=1)
+def read_session_file(session_file, mtime_ns):
+    """Parse a session file, reusing the result until the file changes"""
+    if session_file.endswith(".pkl"):
+        import pickle
+
+        with open(session_file, 'rb') as f:
+            return pickle.load(f)
+
+    with open(session_file, 'rb') as f:
+        return orjson.loads(f.read())
 
 
 def load_icloud_session():
     """Load saved iCloud session"""
     # Look for session file - check Docker location first, then parent directory
-    docker_session_file = os.path.join(os.path.dirname(__file__), "icloud_session.pkl")
-    parent_session_file = os.path.join(os.path.dirname(__file__), "..", "icloud_session.pkl")
-
-    if os.path.exists(docker_session_file):
-        session_file = docker_session_file
+    base_dirs = [os.path.dirname(__file__), os.path.join(os.path.dirname(__file__), "..")]
+
+    for base_dir in base_dirs:
+        session_file = os.path.join(base_dir, "icloud_session.json")
+        if os.path.exists(session_file):
+            break
+        # Sessions saved by older versions of setup/icloud_auth.py
+        legacy_session_file = os.path.join(base_dir, "icloud_session.pkl")
+        if os.path.exists(legacy_session_file):
+            session_file = legacy_session_file
+            break
     else:
-        session_file = parent_session_file
-
-    if not os.path.exists(session_file):
         raise FileNotFoundError(
             f"No saved session found at {session_file}. "
             "Please run 'poetry run python setup/icloud_auth.py' first."
         )
 
-    with open(session_file, 'rb') as f:
-        session_data = pickle.load(f)
+    session_data = read_session_file(session_file, os.stat(session_file).st_mtime_ns)
 
-    api = PyiCloudService(
-        session_data['email'],
-        session_data['password']
-    )
+    if session_file.endswith(".pkl"):
+        api = PyiCloudService(
+            session_data['email'],
+            session_data['password']
+        )
+    else:
+        try:
+            password = keyring.get_password("icloud", session_data['email'])
+        except KeyringError:
+            # No keyring inside Docker; rely on the trusted session cookies
+            password = None
+
+        api = PyiCloudService(
+            session_data['email'],
+            password,
+            cookie_directory=os.path.join(base_dir, session_data['cookie_directory'])
+        )
 
     # Try to access devices to verify session is valid
     try:
@@ -117,10 +309,18 @@ def load_icloud_session():
             raise Exception("Session expired. Please re-authenticate with setup/icloud_auth.py")
         raise
 
-    print("✓ iCloud session loaded")
+    logger.info("✓ iCloud session loaded")
     return api
 
 
+def refresh_devices(api):
+    """Refresh every Find My device of the account with one request"""
+    manager = api.devices
+    # pyicloud 2.7+ names it refresh(); earlier 2.x releases refresh_client_with_reauth()
+    refresh = getattr(manager, 'refresh', None) or manager.refresh_client_with_reauth
+    refresh()
+
+
 def find_target_device(api, model_name="iPhone 16 Pro"):
     """Find the target iPhone device"""
     devices = api.devices
@@ -128,83 +328,153 @@ def find_target_device(api, model_name="iPhone 16 Pro"):
     for device in devices:
         data = device.data
         if data.get('deviceDisplayName') == model_name:
-            print(f"✓ Found target device: {data.get('name')} ({model_name})")
+            logger.info("✓ Found target device: %s (%s)", data.get('name'), model_name)
             return device
 
     raise Exception(f"Could not find device with model: {model_name}")
 
 
+def flush_samples(collection=None):
+    """Write all buffered samples to MongoDB with a single insert_many"""
+    global pending_since
+
+    # pymongo collections can't be truth-tested, so compare with None
+    if collection is None:
+        collection = tracker_collection
+
+    with pending_lock:
+        if not pending_samples:
+            return
+        samples = list(pending_samples)
+        since = pending_since
+        pending_samples.clear()
+        pending_since = None
+
+    try:
+        # pymongo refuses to bypass validation on unacknowledged (w=0) writes,
+        # so only the acknowledged exit flush skips it
+        collection.insert_many(
+            samples,
+            ordered=False,
+            bypass_document_validation=collection.write_concern.acknowledged
+        )
+    except Exception:
+        # Put the samples back so the next flush retries them
+        with pending_lock:
+            pending_samples.extendleft(reversed(samples))
+            pending_since = since if pending_since is None else min(since, pending_since)
+            drop_overflow()
+        raise
+
+
+def drop_overflow():
+    """Drop the oldest pending samples beyond MAX_PENDING_SAMPLES (hold pending_lock)"""
+    overflow = len(pending_samples) - MAX_PENDING_SAMPLES
+    if overflow > 0:
+        for _ in range(overflow):
+            pending_samples.popleft()
+        logger.warning("Sample buffer full, dropped %d oldest sample(s)", overflow)
+
+
+def buffer_sample(device_info):
+    """Queue a sample, flushing once the batch is full or too old"""
+    global pending_since, LAST_WRITE_TS
+
+    with pending_lock:
+        if pending_since is None:
+            pending_since = time.monotonic()
+        pending_samples.append(device_info)
+        drop_overflow()
+        LAST_WRITE_TS = time.time()
+
+        due = (len(pending_samples) >= BATCH_SIZE
+               or time.monotonic() - pending_since >= BATCH_MAX_AGE)
+
+    if due:
+        mongo_writer.submit(flush_samples).add_done_callback(report_flush_error)
+
+
+def report_flush_error(future):
+    """Log the error of a failed background flush"""
+    error = future.exception()
+    if error is not None:
+        logger.error("Error saving to MongoDB: %s", error)
+
+
+def flush_on_exit():
+    """Flush buffered samples with acknowledged writes before exiting"""
+    # Let an in-flight background flush finish first
+    mongo_writer.shutdown(wait=True)
+
+    if mongo_collection is None:
+        return
+
+    try:
+        flush_samples(mongo_collection)
+    except Exception as e:
+        logger.error("Error saving buffered locations: %s", e)
+
+
+@lru_cache(maxsize=1)
+def _status_for_window(window):
+    """Fetch the device status once per cache window"""
+    return target_device.status()
+
+
+def get_device_status():
+    """Get the device status, coalescing calls within STATUS_CACHE_TTL seconds"""
+    return _status_for_window(int(time.monotonic() // max(STATUS_CACHE_TTL, 1)))
+
+
 def track_location():
     """Background thread to continuously track location"""
     global icloud_api, mongo_collection, target_device, tracking_active
 
-    print("🔄 Starting location tracking...")
-    interval = int(os.getenv('TRACKING_INTERVAL', 300))  # Default 5 minutes
+    logger.info("🔄 Starting location tracking...")
+    interval = TRACKING_INTERVAL
+
+    # Ticks are scheduled on a fixed start + n * interval grid so the time
+    # spent fetching and saving doesn't push every later sample back
+    start = time.monotonic()
+    ticks = 0
 
     while tracking_active:
         try:
-            # Fetch device location
+            # Fetch device location. Refresh the account's devices once and
+            # read battery and location from the updated device data, rather
+            # than through status()/location, which refresh again in older
+            # pyicloud releases.
+            refresh_devices(icloud_api)
             data = target_device.data
-            status = target_device.status()
-
-            try:
-                location = target_device.location
-            except:
-                location = None
+            location = data.get('location')
 
             # Prepare document for MongoDB
-            device_info = {
-                "device_id": data.get('id'),
-                "name": data.get('name', 'Unknown'),
-                "model": data.get('deviceDisplayName', 'Unknown'),
-                "device_class": data.get('deviceClass', 'Unknown'),
-                "battery_level": status.get('batteryLevel'),
-                "battery_status": status.get('batteryStatus')
-                # timestamp will be auto-generated by MongoDB
-            }
-
-            if location:
-                device_info["location"] = {
-                    "type": "Point",
-                    "coordinates": [
-                        location.get('longitude'),
-                        location.get('latitude')
-                    ]
-                }
-                device_info["location_data"] = {
-                    "latitude": location.get('latitude'),
-                    "longitude": location.get('longitude'),
-                    "accuracy": location.get('horizontalAccuracy'),
-                    "position_type": location.get('positionType'),
-                    "is_old": location.get('isOld', False),
-                    "location_timestamp": location.get('timeStamp')
-                }
-
-                print(f"📍 Tracked: {device_info['location_data']['latitude']:.6f}, "
-                      f"{device_info['location_data']['longitude']:.6f} "
-                      f"(±{device_info['location_data']['accuracy']}m) "
-                      f"Battery: {status.get('batteryLevel', 0) * 100:.0f}%")
-            else:
-                device_info["location"] = None
-                device_info["location_data"] = None
-                print("📍 Location not available")
-
-            # Save to MongoDB with server-generated timestamp
-            result = mongo_collection.insert_one(device_info)
-
-            # Add server-generated timestamp (MongoDB $currentDate)
-            mongo_collection.update_one(
-                {"_id": result.inserted_id},
-                {"$currentDate": {"timestamp": True}}
-            )
+            device_info = build_device_info(data, location)
+
+            # Only look up the logged fields when INFO is enabled
+            if location and logger.isEnabledFor(logging.INFO):
+                location_data = device_info['location_data']
+                logger.info("📍 Tracked: %.6f, %.6f (±%sm) Battery: %.0f%%",
+                            location_data['latitude'], location_data['longitude'],
+                            location_data['accuracy'], (device_info['battery_level'] or 0) * 100)
+            elif not location:
+                logger.info("📍 Location not available")
+
+            # Save to MongoDB with the next batch
+            buffer_sample(device_info)
 
         except Exception as e:
-            print(f"Error tracking location: {e}")
+            logger.error("Error tracking location: %s", e)
 
-        # Wait for next iteration
-        time.sleep(interval)
+        # Wait for next tick, skipping any that were missed
+        elapsed = time.monotonic() - start
+        next_tick = max(ticks + 1, math.ceil(elapsed / interval))
+        if next_tick > ticks + 1:
+            logger.warning("Tracking fell behind, skipping %d tick(s)", next_tick - ticks - 1)
+        ticks = next_tick
+        time.sleep(max(0, start + ticks * interval - time.monotonic()))
 
-    print("⏹️ Location tracking stopped")
+    logger.info("⏹️ Location tracking stopped")
 
 
 @app.route('/')
@@ -214,7 +484,7 @@ def index():
         "status": "running",
         "service": "iPhone Location Tracker",
         "tracking_active": tracking_active,
-        "device": target_device.data.get('name') if target_device else None
+        "device": DEVICE_NAME
     })
 
 
@@ -223,20 +493,39 @@ def index():
 def get_location():
     """Get the latest location of the iPhone (requires API key)"""
     try:
-        # Get the most recent location from MongoDB
-        latest = mongo_collection.find_one(
-            {"device_id": target_device.data.get('id')},
-            sort=[("timestamp", -1)]
-        )
+        # The location is per API key, so keep it out of shared caches
+        headers = {
+            'Cache-Control': f'private, max-age={TRACKING_INTERVAL // 2}',
+            'Vary': 'X-API-Key'
+        }
+        etag = f'"{LAST_WRITE_TS:.6f}"' if LAST_WRITE_TS else None
+        if etag:
+            headers['ETag'] = etag
+
+        # Nothing new since the client's copy, skip the lookup entirely
+        if etag and request.headers.get('If-None-Match') == etag:
+            return '', 304, headers
+
+        # Samples still waiting for the next batch are the most recent ones
+        with pending_lock:
+            latest = next(
+                ({k: s[k] for k in LOCATION_FIELDS}
+                 for s in reversed(pending_samples) if s['device_id'] == DEVICE_ID),
+                None
+            )
 
         if not latest:
-            return jsonify({"error": "No location data found"}), 404
+            # Get the most recent location from MongoDB
+            latest = mongo_collection.find_one(
+                {"device_id": DEVICE_ID},
+                projection=LOCATION_PROJECTION,
+                sort=[("timestamp", -1)]
+            )
 
-        # Convert ObjectId to string for JSON serialization
-        latest['_id'] = str(latest['_id'])
-        latest['timestamp'] = latest['timestamp'].isoformat()
+        if not latest:
+            return jsonify({"error": "No location data found"}), 404
 
-        return jsonify(latest)
+        return jsonify(latest), 200, headers
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -244,6 +533,7 @@ def get_location():
 
 @app.route('/alarm', methods=['POST'])
 @require_api_key
+@rate_limit("5/minute")
 def trigger_alarm():
     """Trigger the alarm on the iPhone (requires API key)"""
     try:
@@ -252,8 +542,8 @@ def trigger_alarm():
 
         return jsonify({
             "status": "success",
-            "message": f"Alarm triggered on {target_device.data.get('name')}",
-            "timestamp": datetime.utcnow().isoformat() + "Z"
+            "message": f"Alarm triggered on {DEVICE_NAME}",
+            "timestamp": datetime.now(timezone.utc)
         })
 
     except Exception as e:
@@ -265,21 +555,22 @@ def trigger_alarm():
 
 @app.route('/status', methods=['GET'])
 @require_api_key
+@rate_limit("30/minute")
 def get_status():
     """Get current device status (requires API key)"""
     try:
-        status = target_device.status()
+        status = get_device_status()
         data = target_device.data
 
         return jsonify({
-            "device_id": data.get('id'),
-            "name": data.get('name'),
-            "model": data.get('deviceDisplayName'),
+            "device_id": DEVICE_ID,
+            "name": DEVICE_NAME,
+            "model": DEVICE_MODEL,
             "battery_level": status.get('batteryLevel'),
             "battery_status": status.get('batteryStatus'),
             "device_status": data.get('deviceStatus'),
             "location_enabled": data.get('locationEnabled'),
-            "timestamp": datetime.utcnow().isoformat() + "Z"
+            "timestamp": datetime.now(timezone.utc)
         })
 
     except Exception as e:
@@ -288,7 +579,8 @@ def get_status():
 
 def initialize_app():
     """Initialize the application"""
-    global icloud_api, mongo_collection, target_device, tracking_active
+    global icloud_api, mongo_collection, tracker_collection, target_device, tracking_active
+    global DEVICE_ID, DEVICE_NAME, DEVICE_MODEL
 
     print("=" * 80)
     print("iPhone Location Tracker with Alarm API")
@@ -310,11 +602,20 @@ def initialize_app():
     # Connect to MongoDB
     mongo_collection = connect_to_mongodb()
 
+    # Location samples are not critical, so skip waiting for acknowledgement
+    tracker_collection = mongo_collection.with_options(write_concern=WriteConcern(w=0))
+
+    # Don't lose buffered samples when the process exits
+    atexit.register(flush_on_exit)
+
     # Load iCloud session
     icloud_api = load_icloud_session()
 
     # Find target device (iPhone 16 Pro)
     target_device = find_target_device(icloud_api)
+    DEVICE_ID = target_device.data['id']
+    DEVICE_NAME = target_device.data.get('name')
+    DEVICE_MODEL = target_device.data.get('deviceDisplayName')
 
     # Start background tracking thread
     tracking_active = True
@@ -325,9 +626,29 @@ def initialize_app():
     print("=" * 80)
 
 
+def create_app():
+    """Application factory for WSGI servers
+
+    Run with a single threaded worker so the tracker thread, caches and
+    sample buffer are shared by every request:
+        gunicorn -k gthread --workers 1 --threads 8 --bind 0.0.0.0:5000 'app:create_app()'
+    """
+    global initialized_pid
+
+    # Initialize once per process, even if the factory is called again
+    if initialized_pid != os.getpid():
+        initialize_app()
+        initialized_pid = os.getpid()
+
+    return app
+
+
 if __name__ == "__main__":
     try:
-        initialize_app()
+        create_app()
+
+        # Turn `docker stop` (SIGTERM) into a normal exit so buffered samples are flushed
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
         # Get port from environment or use default
         port = int(os.getenv('PORT', 5000))
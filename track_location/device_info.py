@@ -0,0 +1,44 @@
+"""
+Builds the MongoDB document stored for each tracked device sample.
+"""
+
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+
+def build_device_info(data: Dict[str, Any], location: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Build the document for one sample of a device"""
+    d_get = data.get
+
+    device_info = {
+        "device_id": d_get('id'),
+        "name": d_get('name', 'Unknown'),
+        "model": d_get('deviceDisplayName', 'Unknown'),
+        "device_class": d_get('deviceClass', 'Unknown'),
+        "battery_level": d_get('batteryLevel'),
+        "battery_status": d_get('batteryStatus'),
+        "timestamp": datetime.now(timezone.utc)
+    }
+
+    if location:
+        l_get = location.get
+        latitude = l_get('latitude')
+        longitude = l_get('longitude')
+
+        device_info["location"] = {
+            "type": "Point",
+            "coordinates": [longitude, latitude]
+        }
+        device_info["location_data"] = {
+            "latitude": latitude,
+            "longitude": longitude,
+            "accuracy": l_get('horizontalAccuracy'),
+            "position_type": l_get('positionType'),
+            "is_old": l_get('isOld', False),
+            "location_timestamp": l_get('timeStamp')
+        }
+    else:
+        device_info["location"] = None
+        device_info["location_data"] = None
+
+    return device_info
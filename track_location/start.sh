@@ -15,9 +15,9 @@ if [ ! -f ../.env ]; then
     exit 1
 fi
 
-# Check if icloud_session.pkl exists in parent directory
-if [ ! -f ../icloud_session.pkl ]; then
-    echo "❌ Error: icloud_session.pkl not found in parent directory"
+# Check if icloud_session.json exists in parent directory
+if [ ! -f ../icloud_session.json ]; then
+    echo "❌ Error: icloud_session.json not found in parent directory"
     echo "Please authenticate with iCloud first:"
     echo "  cd .. && poetry run python setup/icloud_auth.py"
     echo ""